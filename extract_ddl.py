@@ -20,17 +20,224 @@ The script will create separate files for:
 """
 
 import os
+import io
+import time
+import argparse
+import logging
+import tarfile
 import pyodbc
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 from dotenv import load_dotenv
 
+# Optional columnar ODBC driver, selected with DDL_DRIVER=turbodbc
+try:
+    import turbodbc
+except ImportError:
+    turbodbc = None
+
 # Load environment variables
 load_dotenv()
 
+log = logging.getLogger("ddl_extract")
+
+# Reuse ODBC connections within the process (worker threads and repeated runs)
+pyodbc.pooling = True
+
+# Seconds to wait for a login before giving up
+CONNECT_TIMEOUT = 5
+
+# Rows buffered per driver fetch while streaming result sets to disk
+FETCH_ARRAYSIZE = 10000
+
+# Output file buffer, so streamed DDL reaches the disk in large writes
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# turbodbc truncates (N)VARCHAR(MAX) values to this many characters (its default
+# is 65535, too short for long procedure and table definitions)
+TURBODBC_MAX_CHARACTERS = 4 * 1024 * 1024
+
+# System and fixed-role schemas left out unless SCHEMAS_EXCLUDE overrides the list
+DEFAULT_EXCLUDED_SCHEMAS = [
+    'sys', 'INFORMATION_SCHEMA', 'guest', 'db_owner', 'db_accessadmin', 'db_securityadmin',
+    'db_ddladmin', 'db_backupoperator', 'db_datareader', 'db_datawriter',
+    'db_denydatareader', 'db_denydatawriter',
+]
+
+def schema_predicate(column):
+    """Restrict column to the schema lists bound as (include, include, exclude) parameters.
+    
+    Each list is passed as one comma-separated string, so the query text stays the
+    same whatever the filters are and SQL Server can reuse its cached plan. The
+    lists are matched with CHARINDEX rather than STRING_SPLIT, which needs
+    database compatibility level 130 or higher.
+    """
+    return (
+        f"(? = '' OR CHARINDEX(',' + {column} + ',', ',' + ? + ',') > 0)\n"
+        f"AND CHARINDEX(',' + {column} + ',', ',' + ? + ',') = 0"
+    )
+
+# Catalog queries, one per generated DDL file
+TABLE_QUERY = """
+SELECT 
+    s.name AS schema_name,
+    t.name AS table_name,
+    'CREATE TABLE ' + s.name + '.' + t.name + ' (' + CHAR(10)
+    + STRING_AGG(CAST(
+        '    ' + c.name + ' ' + UPPER(tn.type_name)
+        -- Add length/precision
+        + CASE
+            WHEN tn.type_name IN ('varchar', 'nvarchar', 'char', 'nchar') AND c.max_length = -1 THEN '(MAX)'
+            WHEN tn.type_name IN ('nvarchar', 'nchar') THEN '(' + CAST(c.max_length / 2 AS varchar(10)) + ')'
+            WHEN tn.type_name IN ('varchar', 'char') THEN '(' + CAST(c.max_length AS varchar(10)) + ')'
+            WHEN tn.type_name IN ('decimal', 'numeric') AND c.scale > 0
+                THEN '(' + CAST(c.precision AS varchar(10)) + ',' + CAST(c.scale AS varchar(10)) + ')'
+            WHEN tn.type_name IN ('decimal', 'numeric') THEN '(' + CAST(c.precision AS varchar(10)) + ')'
+            ELSE ''
+        END
+        -- Add nullable and default
+        + CASE WHEN c.is_nullable = 0 THEN ' NOT NULL' ELSE '' END
+        + COALESCE(' DEFAULT ' + OBJECT_DEFINITION(c.default_object_id), '')
+    AS nvarchar(max)), ',' + CHAR(10)) WITHIN GROUP (ORDER BY c.column_id)
+    + CHAR(10) + ');' AS ddl
+FROM sys.tables t
+INNER JOIN sys.schemas s ON t.schema_id = s.schema_id
+INNER JOIN sys.columns c ON t.object_id = c.object_id
+INNER JOIN sys.types ty ON c.user_type_id = ty.user_type_id
+-- Alias types resolve to their base type; CLR types (geography, hierarchyid, ...)
+-- all share system_type_id 240, so those keep their own name
+CROSS APPLY (SELECT COALESCE(TYPE_NAME(NULLIF(c.system_type_id, 240)), ty.name) AS type_name) tn
+WHERE t.is_ms_shipped = 0
+AND t.temporal_type IN (0, 2)  -- Skip system-versioned history tables
+AND {schema_filter}
+GROUP BY s.name, t.name
+ORDER BY s.name, t.name
+OPTION (RECOMPILE)
+""".format(schema_filter=schema_predicate("s.name"))
+
+PK_QUERY = """
+SELECT 
+    tc.TABLE_SCHEMA,
+    tc.TABLE_NAME,
+    tc.CONSTRAINT_NAME,
+    STRING_AGG(kcu.COLUMN_NAME, ', ') WITHIN GROUP (ORDER BY kcu.ORDINAL_POSITION) as COLUMNS
+FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
+INNER JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE kcu 
+    ON tc.CONSTRAINT_NAME = kcu.CONSTRAINT_NAME
+    AND tc.TABLE_SCHEMA = kcu.TABLE_SCHEMA
+    AND tc.TABLE_NAME = kcu.TABLE_NAME
+WHERE tc.CONSTRAINT_TYPE = 'PRIMARY KEY'
+AND {schema_filter}
+GROUP BY tc.TABLE_SCHEMA, tc.TABLE_NAME, tc.CONSTRAINT_NAME
+ORDER BY tc.TABLE_SCHEMA, tc.TABLE_NAME
+""".format(schema_filter=schema_predicate("tc.TABLE_SCHEMA"))
+
+FK_QUERY = """
+SELECT 
+    fk.name AS CONSTRAINT_NAME,
+    tp.name AS PARENT_TABLE,
+    sp.name AS PARENT_SCHEMA,
+    cp.name AS PARENT_COLUMN,
+    tr.name AS REFERENCED_TABLE,
+    sr.name AS REFERENCED_SCHEMA,
+    cr.name AS REFERENCED_COLUMN
+FROM sys.foreign_keys fk
+INNER JOIN sys.foreign_key_columns fkc ON fk.object_id = fkc.constraint_object_id
+INNER JOIN sys.tables tp ON fk.parent_object_id = tp.object_id
+INNER JOIN sys.schemas sp ON tp.schema_id = sp.schema_id
+INNER JOIN sys.columns cp ON fkc.parent_object_id = cp.object_id AND fkc.parent_column_id = cp.column_id
+INNER JOIN sys.tables tr ON fk.referenced_object_id = tr.object_id
+INNER JOIN sys.schemas sr ON tr.schema_id = sr.schema_id
+INNER JOIN sys.columns cr ON fkc.referenced_object_id = cr.object_id AND fkc.referenced_column_id = cr.column_id
+WHERE fk.is_ms_shipped = 0
+AND {schema_filter}
+ORDER BY sp.name, tp.name, fk.name, fkc.constraint_column_id
+""".format(schema_filter=schema_predicate("sp.name"))
+
+VIEW_QUERY = """
+SELECT 
+    TABLE_SCHEMA,
+    TABLE_NAME,
+    VIEW_DEFINITION
+FROM INFORMATION_SCHEMA.VIEWS
+WHERE {schema_filter}
+ORDER BY TABLE_SCHEMA, TABLE_NAME
+""".format(schema_filter=schema_predicate("TABLE_SCHEMA"))
+
+INDEX_QUERY = """
+SELECT 
+    s.name AS schema_name,
+    t.name AS table_name,
+    i.name AS index_name,
+    i.type_desc AS index_type,
+    CASE WHEN i.is_unique = 1 THEN 'UNIQUE ' ELSE '' END AS unique_clause,
+    STRING_AGG(c.name, ', ') WITHIN GROUP (ORDER BY ic.key_ordinal) AS columns
+FROM sys.indexes i
+INNER JOIN sys.tables t ON i.object_id = t.object_id
+INNER JOIN sys.schemas s ON t.schema_id = s.schema_id
+INNER JOIN sys.index_columns ic ON i.object_id = ic.object_id AND i.index_id = ic.index_id
+INNER JOIN sys.columns c ON ic.object_id = c.object_id AND ic.column_id = c.column_id
+WHERE i.type > 0  -- Exclude heaps
+AND i.is_primary_key = 0  -- Exclude primary keys (already handled)
+AND i.is_unique_constraint = 0  -- Exclude unique constraints
+AND t.is_ms_shipped = 0
+AND t.temporal_type IN (0, 2)  -- Skip system-versioned history tables, as in TABLE_QUERY
+AND {schema_filter}
+AND (? = 1 OR EXISTS (  -- Skip indexes on empty tables unless requested
+    SELECT 1 FROM sys.partitions p
+    WHERE p.object_id = t.object_id AND p.index_id IN (0, 1) AND p.rows > 0
+))
+GROUP BY s.name, t.name, i.name, i.type_desc, i.is_unique
+ORDER BY s.name, t.name, i.name
+""".format(schema_filter=schema_predicate("s.name"))
+
+SP_QUERY = """
+SELECT 
+    s.name AS schema_name,
+    p.name AS procedure_name,
+    m.definition
+FROM sys.procedures p
+INNER JOIN sys.schemas s ON p.schema_id = s.schema_id
+INNER JOIN sys.sql_modules m ON p.object_id = m.object_id
+WHERE p.is_ms_shipped = 0
+AND {schema_filter}
+ORDER BY s.name, p.name
+""".format(schema_filter=schema_predicate("s.name"))
+
+# Per-object DDL, filled positionally from the columns of each catalog query row
+TABLE_TEMPLATE = "{2}\n\n"
+PK_TEMPLATE = "ALTER TABLE {0}.{1}\nADD CONSTRAINT {2} PRIMARY KEY ({3});\n\n"
+FK_TEMPLATE = "ALTER TABLE {2}.{1}\nADD CONSTRAINT {0} FOREIGN KEY ({3})\nREFERENCES {5}.{4}({6});\n\n"
+VIEW_TEMPLATE = "CREATE VIEW {0}.{1} AS\n{2};\n\n"
+INDEX_TEMPLATE = "CREATE {4}INDEX {2}\nON {0}.{1} ({5});\n\n"
+SP_TEMPLATE = "-- {0}.{1}\n{2};\n\n"
+
+# All six queries sent as a single batch; each SELECT comes back as its own result set
+BATCH_QUERY = "SET NOCOUNT ON;\n" + ";\n".join(
+    [TABLE_QUERY, PK_QUERY, FK_QUERY, VIEW_QUERY, INDEX_QUERY, SP_QUERY]
+)
+
+# Changes whenever any schema object is created, altered or dropped
+SCHEMA_HASH_QUERY = "SELECT CHECKSUM_AGG(CHECKSUM(object_id, modify_date)) FROM sys.objects"
+
+def env_list(name):
+    """Read a comma-separated list from an environment variable."""
+    value = os.environ.get(name, "")
+    return [item.strip() for item in value.split(",") if item.strip()]
+
 class DDLExtractor:
     def __init__(self):
         self.ddl_dir = Path("data/ddl")
         self.ddl_dir.mkdir(parents=True, exist_ok=True)
+        self.hash_file = self.ddl_dir / ".schema_hash"
+        self.archive_file = self.ddl_dir / "schema.tar.gz"
+        
+        # File name -> content, collected instead of writing files when archiving
+        self.archive_contents = None
         
         # Database connection details
         self.host = os.environ.get("SQLSERVER_HOST")
@@ -38,299 +245,169 @@ class DDLExtractor:
         self.user = os.environ.get("SQLSERVER_USER")
         self.password = os.environ.get("SQLSERVER_PASSWORD")
         
+        # Number of parallel connections; 1 sends all queries as a single batch
+        self.workers = int(os.environ.get("DDL_EXTRACT_WORKERS", "1"))
+        
+        # Database driver: pyodbc (default) or turbodbc
+        self.driver = os.environ.get("DDL_DRIVER", "pyodbc").lower()
+        if self.driver == "turbodbc" and turbodbc is None:
+            log.warning("turbodbc is not installed - falling back to pyodbc")
+            self.driver = "pyodbc"
+        
+        # Schema filters (comma-separated); by default all non-system schemas are extracted
+        self.schemas_include = env_list("SCHEMAS_INCLUDE")
+        self.schemas_exclude = env_list("SCHEMAS_EXCLUDE") or DEFAULT_EXCLUDED_SCHEMAS
+        
         # Auto-detect if running in Docker container
         self.is_docker = os.path.exists('/.dockerenv')
         
         if self.is_docker:
-            print("Running in Docker - using SQL Server authentication")
+            log.info("Running in Docker - using SQL Server authentication")
             self.conn_str = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={self.host};DATABASE={self.database};UID={self.user};PWD={self.password}"
         else:
-            print("Running on Windows - using Windows authentication")
+            log.info("Running on Windows - using Windows authentication")
             self.conn_str = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={self.host};DATABASE={self.database};Trusted_Connection=yes"
+        
+        # Larger TDS packets (default 4 KB) for the big definition columns
+        self.conn_str += ";Packet Size=32768"
+        self.conn_str += ";Encrypt=yes;TrustServerCertificate=yes"
+        
+        self.conn = None
+        self.cursor = None
+    
+    def _make_conn(self):
+        """Open a new connection to the database."""
+        if self.driver == "turbodbc":
+            options = turbodbc.make_options(
+                read_buffer_size=turbodbc.Megabytes(100),
+                varchar_max_character_limit=TURBODBC_MAX_CHARACTERS,
+                use_async_io=True
+            )
+            return turbodbc.connect(connection_string=self.conn_str, turbodbc_options=options)
+        return pyodbc.connect(self.conn_str, timeout=CONNECT_TIMEOUT)
+    
+    def __enter__(self):
+        if not self.connect_to_database():
+            raise ConnectionError(f"Could not connect to database {self.database}")
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     def connect_to_database(self):
         """Establish connection to the database."""
         try:
-            self.conn = pyodbc.connect(self.conn_str)
+            self.conn = self._make_conn()
             self.cursor = self.conn.cursor()
-            print(f"✓ Connected to database: {self.database}")
+            self.cursor.arraysize = FETCH_ARRAYSIZE
+            log.info("✓ Connected to database: %s", self.database)
             return True
         except Exception as e:
-            print(f"❌ Failed to connect to database: {e}")
+            log.error("❌ Failed to connect to database: %s", e)
             return False
     
-    def extract_table_ddl(self):
-        """Extract DDL for all tables."""
-        print("\n📋 Extracting table definitions...")
-        
-        # Query to get table information
-        table_query = """
-        SELECT 
-            t.TABLE_SCHEMA,
-            t.TABLE_NAME,
-            c.COLUMN_NAME,
-            c.DATA_TYPE,
-            c.CHARACTER_MAXIMUM_LENGTH,
-            c.NUMERIC_PRECISION,
-            c.NUMERIC_SCALE,
-            c.IS_NULLABLE,
-            c.COLUMN_DEFAULT,
-            c.ORDINAL_POSITION
-        FROM INFORMATION_SCHEMA.TABLES t
-        INNER JOIN INFORMATION_SCHEMA.COLUMNS c 
-            ON t.TABLE_NAME = c.TABLE_NAME 
-            AND t.TABLE_SCHEMA = c.TABLE_SCHEMA
-        WHERE t.TABLE_TYPE = 'BASE TABLE'
-        ORDER BY t.TABLE_SCHEMA, t.TABLE_NAME, c.ORDINAL_POSITION
-        """
-        
-        self.cursor.execute(table_query)
-        results = self.cursor.fetchall()
-        
-        tables = {}
-        for row in results:
-            schema, table_name, col_name, data_type, char_len, num_prec, num_scale, nullable, default, pos = row
-            
-            full_table_name = f"{schema}.{table_name}"
-            if full_table_name not in tables:
-                tables[full_table_name] = []
-            
-            # Build column definition
-            col_def = f"    {col_name} {data_type.upper()}"
-            
-            # Add length/precision
-            if data_type.upper() in ['VARCHAR', 'NVARCHAR', 'CHAR', 'NCHAR'] and char_len:
-                if char_len == -1:
-                    col_def += "(MAX)"
-                else:
-                    col_def += f"({char_len})"
-            elif data_type.upper() in ['DECIMAL', 'NUMERIC'] and num_prec:
-                if num_scale:
-                    col_def += f"({num_prec},{num_scale})"
-                else:
-                    col_def += f"({num_prec})"
-            
-            # Add nullable
-            if nullable == 'NO':
-                col_def += " NOT NULL"
-            
-            # Add default
-            if default:
-                col_def += f" DEFAULT {default}"
-            
-            tables[full_table_name].append(col_def)
-        
-        # Generate CREATE TABLE statements
-        ddl_content = "-- Table Definitions\n-- Generated automatically from database schema\n\n"
+    def close(self):
+        """Close the database connection, if open."""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            self.cursor = None
+            log.info("✓ Database connection closed")
+    
+    def extract_table_ddl(self, rows, out):
+        """Extract DDL for all tables (rendered server-side, one row per table)."""
+        log.info("\n📋 Extracting table definitions...")
         
-        for table_name, columns in tables.items():
-            ddl_content += f"CREATE TABLE {table_name} (\n"
-            ddl_content += ",\n".join(columns)
-            ddl_content += "\n);\n\n"
+        out.write("-- Table Definitions\n-- Generated automatically from database schema\n\n")
         
-        # Save to file
-        table_file = self.ddl_dir / "01_tables.sql"
-        with open(table_file, 'w', encoding='utf-8') as f:
-            f.write(ddl_content)
+        count = 0
+        for count, row in enumerate(rows, 1):
+            out.write(TABLE_TEMPLATE.format(*row))
         
-        print(f"✓ Saved {len(tables)} table definitions to {table_file}")
-        return len(tables)
+        log.info("✓ Extracted %s table definitions", count)
+        return count
     
-    def extract_primary_keys(self):
+    def extract_primary_keys(self, rows, out):
         """Extract primary key constraints."""
-        print("\n🔑 Extracting primary keys...")
-        
-        pk_query = """
-        SELECT 
-            tc.TABLE_SCHEMA,
-            tc.TABLE_NAME,
-            tc.CONSTRAINT_NAME,
-            STRING_AGG(kcu.COLUMN_NAME, ', ') WITHIN GROUP (ORDER BY kcu.ORDINAL_POSITION) as COLUMNS
-        FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
-        INNER JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE kcu 
-            ON tc.CONSTRAINT_NAME = kcu.CONSTRAINT_NAME
-            AND tc.TABLE_SCHEMA = kcu.TABLE_SCHEMA
-            AND tc.TABLE_NAME = kcu.TABLE_NAME
-        WHERE tc.CONSTRAINT_TYPE = 'PRIMARY KEY'
-        GROUP BY tc.TABLE_SCHEMA, tc.TABLE_NAME, tc.CONSTRAINT_NAME
-        ORDER BY tc.TABLE_SCHEMA, tc.TABLE_NAME
-        """
-        
-        self.cursor.execute(pk_query)
-        results = self.cursor.fetchall()
+        log.info("\n🔑 Extracting primary keys...")
         
-        ddl_content = "-- Primary Key Constraints\n-- Generated automatically from database schema\n\n"
+        out.write("-- Primary Key Constraints\n-- Generated automatically from database schema\n\n")
         
-        for row in results:
-            schema, table_name, constraint_name, columns = row
-            ddl_content += f"ALTER TABLE {schema}.{table_name}\n"
-            ddl_content += f"ADD CONSTRAINT {constraint_name} PRIMARY KEY ({columns});\n\n"
+        count = 0
+        for count, row in enumerate(rows, 1):
+            out.write(PK_TEMPLATE.format(*row))
         
-        # Save to file
-        pk_file = self.ddl_dir / "02_primary_keys.sql"
-        with open(pk_file, 'w', encoding='utf-8') as f:
-            f.write(ddl_content)
-        
-        print(f"✓ Saved {len(results)} primary key constraints to {pk_file}")
-        return len(results)
+        log.info("✓ Extracted %s primary key constraints", count)
+        return count
     
-    def extract_foreign_keys(self):
+    def extract_foreign_keys(self, rows, out):
         """Extract foreign key constraints."""
-        print("\n🔗 Extracting foreign keys...")
-        
-        fk_query = """
-        SELECT 
-            fk.name AS CONSTRAINT_NAME,
-            tp.name AS PARENT_TABLE,
-            sp.name AS PARENT_SCHEMA,
-            cp.name AS PARENT_COLUMN,
-            tr.name AS REFERENCED_TABLE,
-            sr.name AS REFERENCED_SCHEMA,
-            cr.name AS REFERENCED_COLUMN
-        FROM sys.foreign_keys fk
-        INNER JOIN sys.foreign_key_columns fkc ON fk.object_id = fkc.constraint_object_id
-        INNER JOIN sys.tables tp ON fk.parent_object_id = tp.object_id
-        INNER JOIN sys.schemas sp ON tp.schema_id = sp.schema_id
-        INNER JOIN sys.columns cp ON fkc.parent_object_id = cp.object_id AND fkc.parent_column_id = cp.column_id
-        INNER JOIN sys.tables tr ON fk.referenced_object_id = tr.object_id
-        INNER JOIN sys.schemas sr ON tr.schema_id = sr.schema_id
-        INNER JOIN sys.columns cr ON fkc.referenced_object_id = cr.object_id AND fkc.referenced_column_id = cr.column_id
-        ORDER BY sp.name, tp.name, fk.name
-        """
-        
-        self.cursor.execute(fk_query)
-        results = self.cursor.fetchall()
-        
-        ddl_content = "-- Foreign Key Constraints\n-- Generated automatically from database schema\n\n"
-        
-        for row in results:
-            constraint_name, parent_table, parent_schema, parent_column, ref_table, ref_schema, ref_column = row
-            ddl_content += f"ALTER TABLE {parent_schema}.{parent_table}\n"
-            ddl_content += f"ADD CONSTRAINT {constraint_name} FOREIGN KEY ({parent_column})\n"
-            ddl_content += f"REFERENCES {ref_schema}.{ref_table}({ref_column});\n\n"
-        
-        # Save to file
-        fk_file = self.ddl_dir / "03_foreign_keys.sql"
-        with open(fk_file, 'w', encoding='utf-8') as f:
-            f.write(ddl_content)
-        
-        print(f"✓ Saved {len(results)} foreign key constraints to {fk_file}")
-        return len(results)
+        log.info("\n🔗 Extracting foreign keys...")
+        
+        out.write("-- Foreign Key Constraints\n-- Generated automatically from database schema\n\n")
+        
+        # One row per column pair; rows of the same constraint are adjacent, so
+        # group them to emit composite keys as a single constraint
+        count = 0
+        constraints = groupby(rows, key=itemgetter(0, 1, 2, 4, 5))
+        for count, (key, fk_rows) in enumerate(constraints, 1):
+            constraint_name, parent_table, parent_schema, ref_table, ref_schema = key
+            fk_rows = list(fk_rows)
+            parent_columns = ", ".join(row[3] for row in fk_rows)
+            ref_columns = ", ".join(row[6] for row in fk_rows)
+            out.write(FK_TEMPLATE.format(
+                constraint_name, parent_table, parent_schema, parent_columns,
+                ref_table, ref_schema, ref_columns
+            ))
+        
+        log.info("✓ Extracted %s foreign key constraints", count)
+        return count
     
-    def extract_views(self):
+    def extract_views(self, rows, out):
         """Extract view definitions."""
-        print("\n👁️ Extracting views...")
-        
-        view_query = """
-        SELECT 
-            TABLE_SCHEMA,
-            TABLE_NAME,
-            VIEW_DEFINITION
-        FROM INFORMATION_SCHEMA.VIEWS
-        ORDER BY TABLE_SCHEMA, TABLE_NAME
-        """
-        
-        self.cursor.execute(view_query)
-        results = self.cursor.fetchall()
-        
-        ddl_content = "-- View Definitions\n-- Generated automatically from database schema\n\n"
+        log.info("\n👁️ Extracting views...")
         
-        for row in results:
-            schema, view_name, definition = row
-            ddl_content += f"CREATE VIEW {schema}.{view_name} AS\n"
-            ddl_content += f"{definition};\n\n"
+        out.write("-- View Definitions\n-- Generated automatically from database schema\n\n")
         
-        # Save to file
-        view_file = self.ddl_dir / "04_views.sql"
-        with open(view_file, 'w', encoding='utf-8') as f:
-            f.write(ddl_content)
+        count = 0
+        for count, row in enumerate(rows, 1):
+            out.write(VIEW_TEMPLATE.format(*row))
         
-        print(f"✓ Saved {len(results)} view definitions to {view_file}")
-        return len(results)
+        log.info("✓ Extracted %s view definitions", count)
+        return count
     
-    def extract_indexes(self):
+    def extract_indexes(self, rows, out):
         """Extract index definitions."""
-        print("\n📇 Extracting indexes...")
-        
-        index_query = """
-        SELECT 
-            s.name AS schema_name,
-            t.name AS table_name,
-            i.name AS index_name,
-            i.type_desc AS index_type,
-            i.is_unique,
-            STRING_AGG(c.name, ', ') WITHIN GROUP (ORDER BY ic.key_ordinal) AS columns
-        FROM sys.indexes i
-        INNER JOIN sys.tables t ON i.object_id = t.object_id
-        INNER JOIN sys.schemas s ON t.schema_id = s.schema_id
-        INNER JOIN sys.index_columns ic ON i.object_id = ic.object_id AND i.index_id = ic.index_id
-        INNER JOIN sys.columns c ON ic.object_id = c.object_id AND ic.column_id = c.column_id
-        WHERE i.type > 0  -- Exclude heaps
-        AND i.is_primary_key = 0  -- Exclude primary keys (already handled)
-        AND i.is_unique_constraint = 0  -- Exclude unique constraints
-        GROUP BY s.name, t.name, i.name, i.type_desc, i.is_unique
-        ORDER BY s.name, t.name, i.name
-        """
-        
-        self.cursor.execute(index_query)
-        results = self.cursor.fetchall()
+        log.info("\n📇 Extracting indexes...")
         
-        ddl_content = "-- Index Definitions\n-- Generated automatically from database schema\n\n"
+        out.write("-- Index Definitions\n-- Generated automatically from database schema\n\n")
         
-        for row in results:
-            schema, table_name, index_name, index_type, is_unique, columns = row
-            
-            unique_clause = "UNIQUE " if is_unique else ""
-            ddl_content += f"CREATE {unique_clause}INDEX {index_name}\n"
-            ddl_content += f"ON {schema}.{table_name} ({columns});\n\n"
+        count = 0
+        for count, row in enumerate(rows, 1):
+            out.write(INDEX_TEMPLATE.format(*row))
         
-        # Save to file
-        index_file = self.ddl_dir / "05_indexes.sql"
-        with open(index_file, 'w', encoding='utf-8') as f:
-            f.write(ddl_content)
-        
-        print(f"✓ Saved {len(results)} index definitions to {index_file}")
-        return len(results)
+        log.info("✓ Extracted %s index definitions", count)
+        return count
     
-    def extract_stored_procedures(self):
+    def extract_stored_procedures(self, rows, out):
         """Extract stored procedure definitions."""
-        print("\n⚙️ Extracting stored procedures...")
-        
-        sp_query = """
-        SELECT 
-            s.name AS schema_name,
-            p.name AS procedure_name,
-            m.definition
-        FROM sys.procedures p
-        INNER JOIN sys.schemas s ON p.schema_id = s.schema_id
-        INNER JOIN sys.sql_modules m ON p.object_id = m.object_id
-        ORDER BY s.name, p.name
-        """
+        log.info("\n⚙️ Extracting stored procedures...")
         
-        self.cursor.execute(sp_query)
-        results = self.cursor.fetchall()
+        out.write("-- Stored Procedure Definitions\n-- Generated automatically from database schema\n\n")
         
-        ddl_content = "-- Stored Procedure Definitions\n-- Generated automatically from database schema\n\n"
+        count = 0
+        for count, row in enumerate(rows, 1):
+            out.write(SP_TEMPLATE.format(*row))
         
-        for row in results:
-            schema, sp_name, definition = row
-            ddl_content += f"-- {schema}.{sp_name}\n"
-            ddl_content += f"{definition};\n\n"
-        
-        # Save to file
-        sp_file = self.ddl_dir / "06_stored_procedures.sql"
-        with open(sp_file, 'w', encoding='utf-8') as f:
-            f.write(ddl_content)
-        
-        print(f"✓ Saved {len(results)} stored procedure definitions to {sp_file}")
-        return len(results)
+        log.info("✓ Extracted %s stored procedure definitions", count)
+        return count
     
     def create_summary_file(self, counts):
         """Create a summary file with database schema information."""
         summary_content = f"""-- Database Schema Summary
 -- Database: {self.database}
 -- Server: {self.host}
--- Extracted on: {os.popen('date /t').read().strip()} {os.popen('time /t').read().strip()}
+-- Extracted on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
 /*
 Schema Summary:
@@ -355,62 +432,190 @@ python train_from_files.py
 */
 """
         
-        summary_file = self.ddl_dir / "00_schema_summary.sql"
-        with open(summary_file, 'w', encoding='utf-8') as f:
+        with self._output("00_schema_summary.sql") as f:
             f.write(summary_content)
         
-        print(f"✓ Created schema summary: {summary_file}")
+        log.info("✓ Created schema summary: %s", self.ddl_dir / '00_schema_summary.sql')
+    
+    def _current_schema_hash(self, include_empty, archive):
+        """Return a checksum of the current schema object definitions and extraction options."""
+        self.cursor.execute(SCHEMA_HASH_QUERY)
+        checksum = self.cursor.fetchone()[0]
+        schemas = f"{','.join(self.schemas_include)}|{','.join(self.schemas_exclude)}"
+        return f"{checksum}|{schemas}|{int(include_empty)}|{int(archive)}"
+    
+    def _schema_params(self):
+        """Parameters for one schema_predicate() in a catalog query."""
+        include = ",".join(self.schemas_include)
+        return [include, include, ",".join(self.schemas_exclude)]
+    
+    @contextmanager
+    def _output(self, filename):
+        """Yield a text stream for one DDL file, written to disk or collected for the archive."""
+        if self.archive_contents is None:
+            with open(self.ddl_dir / filename, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as out:
+                yield out
+        else:
+            out = io.StringIO()
+            yield out
+            self.archive_contents[filename] = out.getvalue()
+    
+    def _write_output(self, filename, extract, rows):
+        """Stream one extractor's rows into its output and return the count."""
+        with self._output(filename) as out:
+            return extract(rows, out)
+    
+    def _write_archive(self):
+        """Write the collected DDL files into a single gzip-compressed tarball."""
+        mtime = time.time()
+        with tarfile.open(self.archive_file, 'w:gz', compresslevel=6) as tf:
+            for name, content in sorted(self.archive_contents.items()):
+                data = content.encode('utf-8')
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = 0o644
+                info.mtime = mtime
+                tf.addfile(info, io.BytesIO(data))
+        log.info("✓ Saved %s files to archive: %s", len(self.archive_contents), self.archive_file)
+        
+        # Loose files from an earlier non-archive run no longer match the archive
+        stale = [self.ddl_dir / name for name in self.archive_contents if (self.ddl_dir / name).exists()]
+        for path in stale:
+            path.unlink()
+        if stale:
+            log.info("✓ Removed %s stale .sql files from %s", len(stale), self.ddl_dir)
+    
+    def _run_one(self, name, filename, query, params, extract):
+        """Run a single catalog query on its own connection."""
+        conn = self._make_conn()
+        try:
+            cursor = conn.cursor()
+            cursor.arraysize = FETCH_ARRAYSIZE
+            cursor.execute(query, params)
+            return name, self._write_output(filename, extract, cursor)
+        finally:
+            conn.close()
     
-    def run_extraction(self):
-        """Run the complete DDL extraction process."""
-        print("🚀 Starting DDL extraction from database...")
-        print("=" * 60)
+    def run_extraction(self, force=False, include_empty=False, archive=False):
+        """Run the complete DDL extraction process.
+        
+        Extraction is skipped when the schema is unchanged since the last run,
+        unless force is set. Indexes on empty tables are left out unless
+        include_empty is set. With archive, all files are written into
+        schema.tar.gz instead of individual .sql files. When used as a
+        context manager the connection is kept open across calls; otherwise
+        it is opened and closed here.
+        """
+        log.info("🚀 Starting DDL extraction from database...")
+        log.info("=" * 60)
         
-        if not self.connect_to_database():
+        owns_connection = self.conn is None
+        if owns_connection and not self.connect_to_database():
             return
         
         counts = {}
-        
+        self.archive_contents = {} if archive else None
+        
+        # Listed in the same order as the queries in BATCH_QUERY
+        schema_params = self._schema_params()
+        index_params = schema_params + [int(include_empty)]
+        extractors = [
+            ('tables', '01_tables.sql', TABLE_QUERY, schema_params, self.extract_table_ddl),
+            ('primary_keys', '02_primary_keys.sql', PK_QUERY, schema_params, self.extract_primary_keys),
+            ('foreign_keys', '03_foreign_keys.sql', FK_QUERY, schema_params, self.extract_foreign_keys),
+            ('views', '04_views.sql', VIEW_QUERY, schema_params, self.extract_views),
+            ('indexes', '05_indexes.sql', INDEX_QUERY, index_params, self.extract_indexes),
+            ('stored_procedures', '06_stored_procedures.sql', SP_QUERY, schema_params, self.extract_stored_procedures),
+        ]
+
         try:
-            # Extract all DDL components
-            counts['tables'] = self.extract_table_ddl()
-            counts['primary_keys'] = self.extract_primary_keys()
-            counts['foreign_keys'] = self.extract_foreign_keys()
-            counts['views'] = self.extract_views()
-            counts['indexes'] = self.extract_indexes()
-            counts['stored_procedures'] = self.extract_stored_procedures()
+            schema_hash = self._current_schema_hash(include_empty, archive)
+            if not force and self.hash_file.exists() and self.hash_file.read_text().strip() == schema_hash:
+                if archive:
+                    expected = [self.archive_file]
+                else:
+                    expected = [self.ddl_dir / name for name in ['00_schema_summary.sql'] + [step[1] for step in extractors]]
+                missing = [path.name for path in expected if not path.exists()]
+                if not missing:
+                    log.info("✓ Schema unchanged since last extraction, skipping (existing files in %s)", self.ddl_dir)
+                    log.info("  Use --force to extract anyway")
+                    return
+                log.info("Schema unchanged but output is missing (%s), extracting again", ", ".join(missing))
             
+            if self.workers > 1:
+                # Run each query on its own connection; each extractor writes its own file
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    futures = [
+                        pool.submit(self._run_one, name, filename, query, params, extract)
+                        for name, filename, query, params, extract in extractors
+                    ]
+                    for future in as_completed(futures):
+                        name, count = future.result()
+                        counts[name] = count
+            elif self.driver == "turbodbc":
+                # turbodbc cannot walk multiple result sets, so run the queries one by one
+                for name, filename, query, params, extract in extractors:
+                    self.cursor.execute(query, params)
+                    counts[name] = self._write_output(filename, extract, self.cursor)
+            else:
+                # Extract all DDL components in a single round-trip
+                batch_params = [param for step in extractors for param in step[3]]
+                self.cursor.execute(BATCH_QUERY, batch_params)
+                for name, filename, _query, _params, extract in extractors:
+                    counts[name] = self._write_output(filename, extract, self.cursor)
+                    self.cursor.nextset()
+
             # Create summary
             self.create_summary_file(counts)
+            if archive:
+                self._write_archive()
+            self.hash_file.write_text(schema_hash)
             
             # Summary
-            print("\n" + "=" * 60)
-            print("📊 Extraction Summary:")
-            print(f"   Tables: {counts['tables']}")
-            print(f"   Primary Keys: {counts['primary_keys']}")
-            print(f"   Foreign Keys: {counts['foreign_keys']}")
-            print(f"   Views: {counts['views']}")
-            print(f"   Indexes: {counts['indexes']}")
-            print(f"   Stored Procedures: {counts['stored_procedures']}")
-            print(f"\n📁 All DDL files saved to: {self.ddl_dir}")
-            print("\n🎉 DDL extraction completed successfully!")
-            print("\nNext steps:")
-            print("1. Review the generated DDL files in data/ddl/")
-            print("2. Run 'python train_from_files.py' to train Vanna AI with this schema")
+            log.info("\n" + "=" * 60)
+            log.info("📊 Extraction Summary:")
+            log.info("   Tables: %s", counts['tables'])
+            log.info("   Primary Keys: %s", counts['primary_keys'])
+            log.info("   Foreign Keys: %s", counts['foreign_keys'])
+            log.info("   Views: %s", counts['views'])
+            log.info("   Indexes: %s", counts['indexes'])
+            log.info("   Stored Procedures: %s", counts['stored_procedures'])
+            log.info("\n📁 All DDL files saved to: %s", self.archive_file if archive else self.ddl_dir)
+            log.info("\n🎉 DDL extraction completed successfully!")
+            log.info("\nNext steps:")
+            if archive:
+                log.info("1. Unpack the archive: tar -xzf %s -C %s", self.archive_file, self.ddl_dir)
+                log.info("2. Run 'python train_from_files.py' to train Vanna AI with this schema")
+            else:
+                log.info("1. Review the generated DDL files in data/ddl/")
+                log.info("2. Run 'python train_from_files.py' to train Vanna AI with this schema")
             
         except Exception as e:
-            print(f"❌ Error during extraction: {e}")
+            log.error("❌ Error during extraction: %s", e)
         finally:
-            self.conn.close()
-            print("✓ Database connection closed")
+            if owns_connection:
+                self.close()
 
 def main():
     """Main function to run the DDL extraction."""
-    print("Database DDL Extractor for Vanna AI")
-    print("===================================")
+    parser = argparse.ArgumentParser(description="Extract DDL from SQL Server for Vanna AI training")
+    parser.add_argument("--force", action="store_true",
+                        help="re-extract even if the schema is unchanged since the last run")
+    parser.add_argument("--include-empty", action="store_true",
+                        help="also extract indexes on tables that have no rows")
+    parser.add_argument("--archive", action="store_true",
+                        help="write all DDL files into data/ddl/schema.tar.gz instead of separate .sql files")
+    parser.add_argument("--quiet", action="store_true",
+                        help="only report warnings and errors")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO, format="%(message)s")
+    
+    log.info("Database DDL Extractor for Vanna AI")
+    log.info("===================================")
     
     extractor = DDLExtractor()
-    extractor.run_extraction()
+    extractor.run_extraction(force=args.force, include_empty=args.include_empty, archive=args.archive)
 
 if __name__ == "__main__":
     main()
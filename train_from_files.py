@@ -9,7 +9,10 @@ Usage:
     python train_from_files.py
 
 Requirements:
-    pip install PyPDF2 python-dotenv requests
+    pip install PyMuPDF python-dotenv requests
+
+PDF text is extracted with PyMuPDF; PyPDF2 is used instead when PyMuPDF is
+not installed. Request payloads are encoded with orjson when it is installed.
 
 Directory structure:
     data/
@@ -19,69 +22,176 @@ Directory structure:
     └── general/      # General documentation
 """
 
+import io
 import os
+import re
+import sys
+import logging
+import argparse
 import json
+import hashlib
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from typing import List, Dict, Any
-import PyPDF2
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 
+# PyMuPDF is much faster than PyPDF2; fall back to PyPDF2 if it is unavailable
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+    import PyPDF2
+
+# orjson encodes large DDL/documentation payloads much faster than the stdlib
+try:
+    import orjson
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+    json_loads = json.loads
+
 # Load environment variables
 load_dotenv()
 
+log = logging.getLogger("vanna_trainer")
+
+# Files read directly as text, without a parser
+TEXT_SUFFIXES = ('.txt', '.md', '.sql')
+
+# Read size when hashing files on Pythons without hashlib.file_digest
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Files extracted ahead of training when PDFs are parsed in worker processes
+READ_AHEAD = 2 * (os.cpu_count() or 1)
+
+# Concurrent requests when examples are sent one at a time
+EXAMPLE_WORKERS = 16
+
+# A "Q:" line, then its "SQL:" line (other lines such as comments may sit in
+# between); the SQL continues over the following lines up to a blank line,
+# a "#" heading or the next "Q:"/"SQL:" line
+_EX_RE = re.compile(r"""
+    ^[ \t]*Q:(?P<q>[^\n]*)\n
+    (?:(?![ \t]*(?:Q|SQL):)[^\n]*\n)*
+    [ \t]*SQL:(?P<s>[^\n]*(?:\n(?![ \t]*(?:Q:|SQL:|\#)|[ \t\r]*$)[^\n]*)*)
+""", re.M | re.X)
+
+def extract_text_from_pdf(pdf_path: Path) -> str:
+    """Extract text content from a PDF file."""
+    try:
+        if pymupdf is not None:
+            with pymupdf.open(str(pdf_path)) as doc:
+                text = "\n".join(page.get_text("text") for page in doc)
+            return text.strip()
+
+        # Parse from memory, without strict-mode cross-reference validation
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_path.read_bytes()), strict=False)
+        text = "\n".join(page.extract_text() or "" for page in pdf_reader.pages)
+        return text.strip()
+    except Exception as e:
+        print(f"Error reading PDF {pdf_path}: {e}")
+        return ""
+
+def read_text_file(file_path: Path) -> str:
+    """Read content from a text file."""
+    try:
+        return file_path.read_text(encoding='utf-8', errors='replace').strip()
+    except Exception as e:
+        print(f"Error reading text file {file_path}: {e}")
+        return ""
+
+# Content reader for each supported file suffix
+_READERS = {
+    '.pdf': extract_text_from_pdf,
+    '.txt': read_text_file,
+    '.md': read_text_file,
+    '.sql': read_text_file,
+}
+
+def extract_file_content(file_path: Path) -> str:
+    """Extract content from PDF, TXT, MD, or SQL file."""
+    reader = _READERS.get(file_path.suffix.lower())
+    if reader is None:
+        print(f"Unsupported file type: {file_path}")
+        return ""
+    return reader(file_path)
+
+def file_sha256(file_path: Path) -> str:
+    """Return the SHA-256 hex digest of a file without loading it into memory."""
+    with open(file_path, 'rb') as file:
+        if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+            return hashlib.file_digest(file, 'sha256').hexdigest()
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+def read_ahead(executor, read, files, limit):
+    """Yield read(file) for each file in order, with at most limit reads in flight."""
+    pending = deque()
+    for file_path in files:
+        pending.append(executor.submit(read, file_path))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def log_response(response):
+    """Log the status and start of a response body, only decoding it when debugging."""
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Response status: %s", response.status_code)
+        log.debug("Response text: %s", response.text[:500])
+
+def read_for(training_type: str, file_path: Path) -> str:
+    """Extract content for a training type; only text files are read for DDL."""
+    if file_path.suffix.lower() in TEXT_SUFFIXES:
+        return read_text_file(file_path)
+    if training_type == "ddl":
+        print(f"⚠️  Skipping {file_path.name}: DDL must be in a .sql, .txt or .md file")
+        return ""
+    return extract_file_content(file_path)
+
 class VannaTrainer:
-    def __init__(self, base_url: str = "http://localhost:5000"):
+    def __init__(self, base_url: str = "http://localhost:5000", batch_examples: bool = True,
+                 force: bool = False):
         self.base_url = base_url
+        self.batch_examples = batch_examples
+        
+        # SHA-256 of each file's bytes as of its last successful training;
+        # force starts from an empty cache so every file is trained again
+        self.cache_file = Path(".vanna_train_cache.json")
+        self.cache = {} if force else self.load_cache()
         self.data_dir = Path("data")
         
-    def extract_text_from_pdf(self, pdf_path: Path) -> str:
-        """Extract text content from a PDF file."""
-        try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text.strip()
-        except Exception as e:
-            print(f"Error reading PDF {pdf_path}: {e}")
-            return ""
-    
-    def read_text_file(self, file_path: Path) -> str:
-        """Read content from a text file."""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read().strip()
-        except Exception as e:
-            print(f"Error reading text file {file_path}: {e}")
-            return ""
-    
-    def extract_file_content(self, file_path: Path) -> str:
-        """Extract content from PDF, TXT, MD, or SQL file."""
-        if file_path.suffix.lower() == '.pdf':
-            return self.extract_text_from_pdf(file_path)
-        elif file_path.suffix.lower() in ['.txt', '.md', '.sql']:
-            return self.read_text_file(file_path)
-        else:
-            print(f"Unsupported file type: {file_path}")
-            return ""
-    
+        # Reuse pooled keep-alive connections across all training requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32,
+                              max_retries=Retry(total=3, backoff_factor=0.2))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+        
     def train_documentation(self, content: str, filename: str) -> bool:
-        """Send documentation to Vanna for training with verbose output."""
-        print(f"[DEBUG] Sending documentation from {filename} to {self.base_url}/train/documentation")
-        print(f"[DEBUG] Content (first 200 chars): {content[:200]!r}")
+        """Send documentation to Vanna for training."""
+        log.debug("Sending documentation from %s to %s/train/documentation", filename, self.base_url)
+        log.debug("Content (first 200 chars): %r", content[:200])
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/train/documentation",
-                json={"documentation": content},
-                headers={"Content-Type": "application/json"},
+                data=json_dumps({"documentation": content}),
                 timeout=30
             )
-            print(f"[DEBUG] Response status: {response.status_code}")
-            print(f"[DEBUG] Response text: {response.text[:500]}")
+            log_response(response)
             if response.status_code == 200:
-                result = response.json()
+                result = json_loads(response.content)
                 if result.get("status") == "success":
                     print(f"✓ Successfully trained documentation from {filename}")
                     return True
@@ -96,20 +206,18 @@ class VannaTrainer:
             return False
     
     def train_ddl(self, content: str, filename: str) -> bool:
-        """Send DDL statements to Vanna for training with verbose output."""
-        print(f"[DEBUG] Sending DDL from {filename} to {self.base_url}/train/ddl")
-        print(f"[DEBUG] Content (first 200 chars): {content[:200]!r}")
+        """Send DDL statements to Vanna for training."""
+        log.debug("Sending DDL from %s to %s/train/ddl", filename, self.base_url)
+        log.debug("Content (first 200 chars): %r", content[:200])
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/train/ddl",
-                json={"ddl": content},
-                headers={"Content-Type": "application/json"},
+                data=json_dumps({"ddl": content}),
                 timeout=30
             )
-            print(f"[DEBUG] Response status: {response.status_code}")
-            print(f"[DEBUG] Response text: {response.text[:500]}")
+            log_response(response)
             if response.status_code == 200:
-                result = response.json()
+                result = json_loads(response.content)
                 if result.get("status") == "success":
                     print(f"✓ Successfully trained DDL from {filename}")
                     return True
@@ -131,68 +239,104 @@ class VannaTrainer:
         SQL: SELECT * FROM table;
         
         Q: Another question?
-        SQL: SELECT COUNT(*) FROM table;
+        SQL: SELECT COUNT(*)
+             FROM table;
+        
+        SQL may span several lines and ends at a blank line, a "#" heading
+        or the next "Q:" line.
         """
         examples = []
-        lines = content.split('\n')
-        current_question = None
-        current_sql = None
-        
-        for line in lines:
-            line = line.strip()
-            if line.startswith('Q:'):
-                current_question = line[2:].strip()
-            elif line.startswith('SQL:'):
-                current_sql = line[4:].strip()
-                if current_question and current_sql:
-                    examples.append({
-                        "question": current_question,
-                        "sql": current_sql
-                    })
-                    current_question = None
-                    current_sql = None
-        
+        for match in _EX_RE.finditer(content):
+            question = match.group("q").strip()
+            sql = match.group("s").strip()
+            if question and sql:
+                examples.append({"question": question, "sql": sql})
         return examples
     
-    def train_examples(self, content: str, filename: str) -> bool:
-        """Train question-SQL examples with verbose output."""
+    def train_examples(self, content: str, filename: str) -> Tuple[int, int]:
+        """Train question-SQL examples; returns the number trained and the number found."""
         examples = self.parse_example_file(content)
+        log.debug("Found %s examples in %s", len(examples), filename)
+        success_count = None
+        if self.batch_examples and examples:
+            success_count = self.train_examples_batch(examples, filename)
+        if success_count is None:
+            success_count = self.train_examples_individually(examples, filename)
+        print(f"📊 Trained {success_count}/{len(examples)} examples from {filename}")
+        return success_count, len(examples)
+    
+    def train_examples_batch(self, examples: List[Dict[str, str]], filename: str) -> Optional[int]:
+        """Send all examples in one request; returns None if the server has no batch endpoint."""
+        log.debug("Sending %s examples to %s/train/question-sql-batch", len(examples), self.base_url)
+        try:
+            response = self.session.post(
+                f"{self.base_url}/train/question-sql-batch",
+                data=json_dumps({"examples": examples}),
+                timeout=300
+            )
+            log_response(response)
+            # Older servers answer the POST from the GET-only catch-all route with 405
+            if response.status_code in (404, 405):
+                log.debug("Batch endpoint not available, sending examples one at a time")
+                return None
+            if response.status_code == 200:
+                result = json_loads(response.content)
+                errors = result.get("errors", [])
+                for error in errors:
+                    print(f"✗ Failed to train example from {filename}: {error}")
+                if result.get("status") != "success" and not errors:
+                    print(f"✗ Failed to train examples from {filename}: {result.get('message')}")
+                return result.get("trained", 0)
+            print(f"✗ HTTP error {response.status_code} for examples from {filename}")
+            return 0
+        except Exception as e:
+            print(f"✗ Error training examples from {filename}: {e}")
+            return 0
+    
+    def post_example(self, example: Dict[str, str]):
+        """POST one question-SQL pair; returns the response, or the exception raised."""
+        try:
+            return self.session.post(
+                f"{self.base_url}/train/question-sql",
+                data=json_dumps(example),
+                timeout=30
+            )
+        except Exception as e:
+            return e
+    
+    def train_examples_individually(self, examples: List[Dict[str, str]], filename: str) -> int:
+        """Send examples one request each, concurrently (for servers without the batch endpoint)."""
         success_count = 0
-        print(f"[DEBUG] Found {len(examples)} examples in {filename}")
-        for i, example in enumerate(examples, 1):
-            print(f"[DEBUG] Sending example {i}: {example}")
-            try:
-                response = requests.post(
-                    f"{self.base_url}/train/question-sql",
-                    json=example,
-                    headers={"Content-Type": "application/json"},
-                    timeout=30
-                )
-                print(f"[DEBUG] Response status: {response.status_code}")
-                print(f"[DEBUG] Response text: {response.text[:500]}")
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("status") == "success":
-                        print(f"✓ Successfully trained example {i} from {filename}")
-                        success_count += 1
+        with ThreadPoolExecutor(max_workers=EXAMPLE_WORKERS) as executor:
+            responses = executor.map(self.post_example, examples)
+            # Report from this loop rather than the workers so output stays in order
+            for i, (example, response) in enumerate(zip(examples, responses), 1):
+                log.debug("Sent example %s: %s", i, example)
+                try:
+                    if isinstance(response, Exception):
+                        raise response
+                    log_response(response)
+                    if response.status_code == 200:
+                        result = json_loads(response.content)
+                        if result.get("status") == "success":
+                            print(f"✓ Successfully trained example {i} from {filename}")
+                            success_count += 1
+                        else:
+                            print(f"✗ Failed to train example {i} from {filename}: {result.get('message')}")
                     else:
-                        print(f"✗ Failed to train example {i} from {filename}: {result.get('message')}")
-                else:
-                    print(f"✗ HTTP error {response.status_code} for example {i} from {filename}")
-            except Exception as e:
-                print(f"✗ Error training example {i} from {filename}: {e}")
-        print(f"📊 Trained {success_count}/{len(examples)} examples from {filename}")
-        return success_count > 0
+                        print(f"✗ HTTP error {response.status_code} for example {i} from {filename}")
+                except Exception as e:
+                    print(f"✗ Error training example {i} from {filename}: {e}")
+        return success_count
     
     def auto_train(self) -> bool:
-        """Trigger auto-training from database schema with verbose output."""
-        print(f"[DEBUG] Sending auto-training request to {self.base_url}/train/auto")
+        """Trigger auto-training from database schema."""
+        log.debug("Sending auto-training request to %s/train/auto", self.base_url)
         try:
-            response = requests.post(f"{self.base_url}/train/auto", timeout=60)
-            print(f"[DEBUG] Response status: {response.status_code}")
-            print(f"[DEBUG] Response text: {response.text[:500]}")
+            response = self.session.post(f"{self.base_url}/train/auto", timeout=60)
+            log_response(response)
             if response.status_code == 200:
-                result = response.json()
+                result = json_loads(response.content)
                 if result.get("status") == "success":
                     print("✓ Successfully completed auto-training from database schema")
                     return True
@@ -206,6 +350,25 @@ class VannaTrainer:
             print(f"✗ Error during auto-training: {e}")
             return False
     
+    def load_cache(self) -> Dict[str, str]:
+        """Load the content hashes of previously trained files."""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"⚠️  Ignoring unreadable training cache {self.cache_file}: {e}")
+            return {}
+    
+    def save_cache(self):
+        """Save the content hashes of trained files for the next run."""
+        try:
+            with open(self.cache_file, 'w', encoding='utf-8') as file:
+                json.dump(self.cache, file, indent=2)
+        except Exception as e:
+            print(f"⚠️  Could not save training cache {self.cache_file}: {e}")
+    
     def process_directory(self, dir_path: Path, training_type: str) -> int:
         """Process all files in a directory for a specific training type."""
         if not dir_path.exists():
@@ -215,34 +378,66 @@ class VannaTrainer:
         print(f"\n📁 Processing {training_type} files in {dir_path}")
         success_count = 0
         
-        # Process PDF, TXT, MD, and SQL files
-        file_patterns = ['*.pdf', '*.txt', '*.md', '*.sql']
-        files = []
-        for pattern in file_patterns:
-            files.extend(dir_path.glob(pattern))
+        # Process PDF, TXT, MD, and SQL files (any case) in a single directory scan
+        with os.scandir(dir_path) as entries:
+            files = sorted(
+                Path(entry.path) for entry in entries
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in _READERS
+            )
         
         if not files:
             print(f"   No files found in {dir_path}")
             return 0
         
+        # Skip files whose content was already trained on a previous run
+        hashes = {}
         for file_path in files:
-            print(f"📄 Processing {file_path.name}...")
-            content = self.extract_file_content(file_path)
-            
-            if not content:
-                print(f"   Skipping {file_path.name} (no content extracted)")
-                continue
-            
-            # Train based on directory type
-            if training_type == "ddl":
-                success = self.train_ddl(content, file_path.name)
-            elif training_type == "examples":
-                success = self.train_examples(content, file_path.name)
-            else:  # documentation
-                success = self.train_documentation(content, file_path.name)
+            try:
+                digest = file_sha256(file_path)
+            except OSError:
+                digest = None  # Reported when the file is read below
+            if digest and self.cache.get(str(file_path)) == digest:
+                print(f"⏭  Skipping {file_path.name} (unchanged since last training)")
+            else:
+                hashes[file_path] = digest
+        files = list(hashes)
+        if not files:
+            return 0
+        
+        # PDF parsing is CPU-bound, so extract in parallel processes when there
+        # is more than one PDF to parse; plain text files are cheaper to read inline.
+        # Either way files are read as training proceeds, not all up front
+        read = partial(read_for, training_type)
+        use_pool = training_type != "ddl" and sum(1 for f in files if f.suffix.lower() == '.pdf') > 1
+        with ProcessPoolExecutor() if use_pool else nullcontext() as executor:
+            if executor is not None:
+                contents = read_ahead(executor, read, files, READ_AHEAD)
+            else:
+                contents = (read(f) for f in files)
             
-            if success:
-                success_count += 1
+            for file_path, content in zip(files, contents):
+                print(f"📄 Processing {file_path.name}...")
+                
+                if not content:
+                    print(f"   Skipping {file_path.name} (no content extracted)")
+                    continue
+                
+                # Train based on directory type
+                complete = True
+                if training_type == "ddl":
+                    success = self.train_ddl(content, file_path.name)
+                elif training_type == "examples":
+                    trained, total = self.train_examples(content, file_path.name)
+                    success = trained > 0
+                    complete = trained == total
+                else:  # documentation
+                    success = self.train_documentation(content, file_path.name)
+                
+                if success:
+                    success_count += 1
+                    # Only cache fully trained files so failed examples are retried next run
+                    if complete and hashes[file_path]:
+                        self.cache[str(file_path)] = hashes[file_path]
         
         return success_count
     
@@ -253,12 +448,14 @@ class VannaTrainer:
         
         # Check if data directory exists
         if not self.data_dir.exists():
-            print(f"❌ Data directory '{self.data_dir}' not found!")
-            print("Please create the data directory with subdirectories:")
-            print("  data/ddl/       - DDL statements")
-            print("  data/docs/      - Documentation files")
-            print("  data/examples/  - Question-SQL examples")
-            print("  data/general/   - General documentation")
+            sys.stdout.write("\n".join([
+                f"❌ Data directory '{self.data_dir}' not found!",
+                "Please create the data directory with subdirectories:",
+                "  data/ddl/       - DDL statements",
+                "  data/docs/      - Documentation files",
+                "  data/examples/  - Question-SQL examples",
+                "  data/general/   - General documentation",
+            ]) + "\n")
             return
         
         total_success = 0
@@ -296,29 +493,45 @@ class VannaTrainer:
         )
         total_success += examples_success
         
-        # Summary
-        print("\n" + "=" * 50)
-        print("📊 Training Summary:")
-        print(f"   Auto-training: {'✓' if total_success > 0 else '✗'}")
-        print(f"   DDL files: {ddl_success} trained")
-        print(f"   Documentation files: {docs_success + general_success} trained")
-        print(f"   Example files: {examples_success} trained")
-        print(f"   Total successful operations: {total_success}")
+        self.save_cache()
+        
+        # Summary, written in one go so it is not interleaved with other output
+        lines = [
+            "\n" + "=" * 50,
+            "📊 Training Summary:",
+            f"   Auto-training: {'✓' if total_success > 0 else '✗'}",
+            f"   DDL files: {ddl_success} trained",
+            f"   Documentation files: {docs_success + general_success} trained",
+            f"   Example files: {examples_success} trained",
+            f"   Total successful operations: {total_success}",
+        ]
         
         if total_success > 0:
-            print("\n🎉 Training completed! Your Vanna AI model has been updated.")
+            lines.append("\n🎉 Training completed! Your Vanna AI model has been updated.")
         else:
-            print("\n⚠️  No training data was successfully processed.")
+            lines.append("\n⚠️  No training data was successfully processed.")
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
 
 def main():
     """Main function to run the training."""
+    parser = argparse.ArgumentParser(description="Train Vanna AI from files in the data directory")
+    parser.add_argument("--verbose", action="store_true",
+                        help="log each request and response sent to the Vanna service")
+    parser.add_argument("--force", action="store_true",
+                        help="train every file, even those unchanged since the last run")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="[%(levelname)s] %(message)s")
+    
     print("Vanna AI Training Data Loader")
     print("============================")
     
     # Check if Vanna service is running
-    trainer = VannaTrainer()
+    trainer = VannaTrainer(force=args.force)
     try:
-        response = requests.get(f"{trainer.base_url}")
+        response = trainer.session.get(f"{trainer.base_url}")
         print(f"✓ Vanna AI service is running at {trainer.base_url}")
     except requests.exceptions.ConnectionError:
         print(f"❌ Cannot connect to Vanna AI service at {trainer.base_url}")
@@ -2,9 +2,20 @@
 
 import os
 import ssl
+import sys
+import inspect
+import atexit
+import signal
+import tempfile
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
 import urllib3
 import httpx
 import requests
+import pyodbc
+import pandas as pd
 from vanna.openai import OpenAI_Chat
 from vanna.chromadb import ChromaDB_VectorStore
 from vanna.flask import VannaFlaskApp
@@ -28,6 +39,7 @@ SQLSERVER_HOST = os.environ.get("SQLSERVER_HOST")
 SQLSERVER_DB = os.environ.get("SQLSERVER_DB")
 SQLSERVER_USER = os.environ.get("SQLSERVER_USER")
 SQLSERVER_PASSWORD = os.environ.get("SQLSERVER_PASSWORD")
+FLASK_DEBUG = os.environ.get("FLASK_DEBUG", "false").lower() == "true"
 
 # SSL and Proxy Configuration
 SSL_VERIFY = os.environ.get("SSL_VERIFY", "false").lower() == "true"
@@ -64,55 +76,41 @@ if HTTP_PROXY:
 if HTTPS_PROXY:
     proxies['https'] = HTTPS_PROXY
 
-# Monkey patch requests and httpx for comprehensive SSL bypass
+# Configure every requests session and httpx client as it is created, so calls
+# made inside Vanna, ChromaDB and the OpenAI SDK get the SSL bypass and proxies
+# without wrapping each individual request
 if not SSL_VERIFY:
     print("Applying comprehensive SSL bypass...")
     
-    # Patch requests globally
-    import requests.adapters
-    import requests.sessions
+    # requests.get/post etc. also create a Session internally
+    original_session_init = requests.Session.__init__
+    def patched_session_init(self, *args, **kwargs):
+        original_session_init(self, *args, **kwargs)
+        self.verify = False
+        self.proxies.update(proxies)
+    requests.Session.__init__ = patched_session_init
     
-    # Monkey patch the HTTPAdapter.send method
-    original_send = requests.adapters.HTTPAdapter.send
-    def patched_send(self, request, **kwargs):
-        kwargs.setdefault('verify', False)
-        kwargs.setdefault('timeout', 30)
-        if proxies:
-            kwargs.setdefault('proxies', proxies)
-        return original_send(self, request, **kwargs)
-    requests.adapters.HTTPAdapter.send = patched_send
+    # httpx.request/get etc. also create a Client internally. httpx 0.28 dropped
+    # the proxies argument, so newer versions get per-scheme proxy transports
+    def patch_httpx_client(client_class, transport_class):
+        original_init = client_class.__init__
+        accepts_proxies = 'proxies' in inspect.signature(original_init).parameters
+        def patched_init(self, *args, **kwargs):
+            kwargs.setdefault('verify', False)
+            kwargs.setdefault('timeout', 30)
+            if proxies and not any(k in kwargs for k in ('proxies', 'proxy', 'mounts', 'transport')):
+                kwargs['proxies'] = proxies
+            if not accepts_proxies and 'proxies' in kwargs:
+                kwargs['mounts'] = {
+                    f"{scheme}://": transport_class(proxy=url, verify=kwargs['verify'])
+                    for scheme, url in kwargs.pop('proxies').items()
+                }
+            original_init(self, *args, **kwargs)
+        client_class.__init__ = patched_init
+    patch_httpx_client(httpx.Client, httpx.HTTPTransport)
+    patch_httpx_client(httpx.AsyncClient, httpx.AsyncHTTPTransport)
     
-    # Patch requests.request
-    original_request = requests.request
-    def patched_request(method, url, **kwargs):
-        kwargs.setdefault('verify', False)
-        kwargs.setdefault('timeout', 30)
-        if proxies:
-            kwargs.setdefault('proxies', proxies)
-        return original_request(method, url, **kwargs)
-    requests.request = patched_request
-    
-    # Patch Session.request
-    original_session_request = requests.sessions.Session.request
-    def patched_session_request(self, method, url, **kwargs):
-        kwargs.setdefault('verify', False)
-        kwargs.setdefault('timeout', 30)
-        if proxies:
-            kwargs.setdefault('proxies', proxies)
-        return original_session_request(self, method, url, **kwargs)
-    requests.sessions.Session.request = patched_session_request
-    
-    # Patch httpx
-    original_httpx_request = httpx.request
-    def patched_httpx_request(method, url, **kwargs):
-        kwargs.setdefault('verify', False)
-        kwargs.setdefault('timeout', 30)
-        if proxies:
-            kwargs.setdefault('proxies', proxies)
-        return original_httpx_request(method, url, **kwargs)
-    httpx.request = patched_httpx_request
-    
-    print("✅ Comprehensive SSL bypass applied to requests, sessions, and httpx")
+    print("✅ Comprehensive SSL bypass applied to requests sessions and httpx clients")
 
 # Auto-detect Docker environment
 def is_running_in_docker():
@@ -129,12 +127,22 @@ else:
     print("Running on Windows - using Windows authentication")
     odbc_conn_str = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={SQLSERVER_HOST};DATABASE={SQLSERVER_DB};Trusted_Connection=yes"
 
+# Most recently used embeddings kept in memory and on disk
+EMBEDDING_CACHE_SIZE = 10000
+
 # Enhanced Vanna class with comprehensive SSL and proxy support
 class MyVanna(ChromaDB_VectorStore, OpenAI_Chat):
     def __init__(self, config=None):
         ChromaDB_VectorStore.__init__(self, config=config)
         OpenAI_Chat.__init__(self, config=config)
         
+        # Embeddings keyed by SHA-256 of the text, so retraining identical
+        # content does not recompute them; saved next to the ChromaDB data
+        self._emb_cache_file = os.path.join((config or {}).get('path', '.'), 'emb_cache.pkl')
+        self._emb_cache = self._load_embedding_cache()
+        self._emb_cache_lock = threading.Lock()
+        atexit.register(self._save_embedding_cache)
+        
         # Create custom OpenAI client with SSL bypass and proxy support
         if not SSL_VERIFY:
             print("Configuring OpenAI client with SSL bypass and proxy support...")
@@ -165,6 +173,57 @@ class MyVanna(ChromaDB_VectorStore, OpenAI_Chat):
         else:
             print("Using standard SSL verification")
 
+    def generate_embedding(self, data, **kwargs):
+        key = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        with self._emb_cache_lock:
+            embedding = self._emb_cache.get(key)
+            if embedding is not None:
+                self._emb_cache.move_to_end(key)
+                return embedding
+        
+        embedding = super().generate_embedding(data, **kwargs)
+        
+        with self._emb_cache_lock:
+            self._emb_cache[key] = embedding
+            if len(self._emb_cache) > EMBEDDING_CACHE_SIZE:
+                self._emb_cache.popitem(last=False)
+        return embedding
+    
+    def _load_embedding_cache(self):
+        try:
+            with open(self._emb_cache_file, 'rb') as f:
+                return OrderedDict(pickle.load(f))
+        except FileNotFoundError:
+            return OrderedDict()
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable embedding cache {self._emb_cache_file}: {e}")
+            return OrderedDict()
+    
+    def _save_embedding_cache(self):
+        try:
+            cache_dir = os.path.dirname(self._emb_cache_file) or '.'
+            os.makedirs(cache_dir, exist_ok=True)
+            
+            # Keep entries saved by other worker processes (e.g. under gunicorn)
+            cache = self._load_embedding_cache()
+            with self._emb_cache_lock:
+                cache.update(self._emb_cache)
+            while len(cache) > EMBEDDING_CACHE_SIZE:
+                cache.popitem(last=False)
+            
+            # Write to a temporary file and swap it in, so an interrupted write
+            # never leaves a truncated cache behind
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='emb_cache.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self._emb_cache_file)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            print(f"⚠️ Could not save embedding cache {self._emb_cache_file}: {e}")
+
 # Initialize Vanna instance
 print("Initializing Vanna with comprehensive SSL/proxy configuration...")
 
@@ -202,14 +261,56 @@ def handle_500_error(e):
     }, 500
 
 # Training endpoints
+
+# Only the columns get_training_plan_generic reads, without system schemas,
+# ordered so each table's columns arrive together
+SCHEMA_COLUMNS_QUERY = """
+    SELECT TABLE_CATALOG, TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA NOT IN ('sys', 'INFORMATION_SCHEMA')
+    ORDER BY TABLE_CATALOG, TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION
+"""
+SCHEMA_CHUNK_SIZE = 5000
+
 @flask_app.route('/train/auto', methods=['POST'])
 def train_auto():
-    """Auto-train from database schema"""
+    """Auto-train from database schema, a chunk of columns at a time"""
     try:
-        df_schema = vn.run_sql("SELECT * FROM INFORMATION_SCHEMA.COLUMNS")
-        plan = vn.get_training_plan_generic(df_schema)
-        vn.train(plan=plan)
-        return {"status": "success", "message": "Auto-training completed"}
+        conn = pyodbc.connect(odbc_conn_str)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(SCHEMA_COLUMNS_QUERY)
+            columns = [column[0] for column in cursor.description]
+            
+            def train_rows(rows):
+                plan = vn.get_training_plan_generic(pd.DataFrame.from_records(rows, columns=columns))
+                vn.train(plan=plan)
+            
+            # Rows arrive ordered by table; hold back the last table of each chunk
+            # so no table's columns are split across two training plans
+            pending = []
+            trained = 0
+            while True:
+                rows = cursor.fetchmany(SCHEMA_CHUNK_SIZE)
+                if not rows:
+                    break
+                pending.extend(tuple(row) for row in rows)
+                split = len(pending)
+                if len(rows) == SCHEMA_CHUNK_SIZE:
+                    last_table = pending[-1][:3]
+                    while split and pending[split - 1][:3] == last_table:
+                        split -= 1
+                if split:
+                    train_rows(pending[:split])
+                    trained += split
+                    pending = pending[split:]
+                    print(f"   Auto-trained {trained} columns...")
+            if pending:
+                train_rows(pending)
+                trained += len(pending)
+        finally:
+            conn.close()
+        return {"status": "success", "message": f"Auto-training completed ({trained} columns)"}
     except Exception as e:
         print(f"❌ Training error: {e}")
         return {"status": "error", "message": str(e)}
@@ -229,6 +330,38 @@ def train_ddl():
         print(f"❌ DDL training error: {e}")
         return {"status": "error", "message": str(e)}
 
+@flask_app.route('/train/question-sql-batch', methods=['POST'])
+def train_question_sql_batch():
+    """Train with a batch of question-SQL pairs in one request"""
+    try:
+        from flask import request
+        data = request.json
+        examples = data.get('examples')
+        if not examples:
+            return {"status": "error", "message": "List of examples required"}
+        trained = 0
+        errors = []
+        for i, example in enumerate(examples, 1):
+            question = example.get('question')
+            sql = example.get('sql')
+            if not question or not sql:
+                errors.append(f"Example {i}: question and sql required")
+                continue
+            try:
+                vn.train(question=question, sql=sql)
+                trained += 1
+            except Exception as e:
+                errors.append(f"Example {i}: {e}")
+        return {
+            "status": "success" if trained else "error",
+            "message": f"Trained {trained}/{len(examples)} examples",
+            "trained": trained,
+            "errors": errors
+        }
+    except Exception as e:
+        print(f"❌ Batch training error: {e}")
+        return {"status": "error", "message": str(e)}
+
 @flask_app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint with SSL and proxy info"""
@@ -264,11 +397,15 @@ def test_openai():
         }, 500
 
 if __name__ == "__main__":
-    print(f"🚀 Starting Flask app with SSL_VERIFY={SSL_VERIFY}")
+    print(f"🚀 Starting Flask app with SSL_VERIFY={SSL_VERIFY}, FLASK_DEBUG={FLASK_DEBUG}")
     print(f"🔧 Proxy configuration: {proxies}")
     
+    # docker stop sends SIGTERM, which would otherwise end the process without
+    # running atexit handlers (so the embedding cache would never be saved)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
     try:
-        app.run(host="0.0.0.0", port=5000, debug=True)
+        app.run(host="0.0.0.0", port=5000, debug=FLASK_DEBUG, threaded=True, use_reloader=FLASK_DEBUG)
     except Exception as e:
         print(f"❌ Failed to start Flask app: {e}")
         import traceback